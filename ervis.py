@@ -22,52 +22,58 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import hashlib
+import sys
+
 from evidence_record import EvidenceRecord
 from evidence_record_print import PrintEr
 
-print(EvidenceRecord().version())
+er = EvidenceRecord(with_bracket=True)
+printer = PrintEr()
+
+print(er.version())
 
 # Create initial hash values
-initial_hashes = ["h1", "h2", "h3"]
+documents = [b"document 1", b"document 2", b"document 3"]
+initial_hashes = [hashlib.sha256(document).digest() for document in documents]
 
 # Create initial hash tree
-tree = EvidenceRecord().create_hashtree(initial_hashes)
+tree = er.create_hashtree(initial_hashes, "SHA256")
 
 # Visualize the full and reduced trees
 print("\n============================================")
 print("\nFull hash tree:")
-full_tree_vis = PrintEr().visualize_tree(tree['root'])
-for line in full_tree_vis:
-    print(line)
+full_tree_vis = printer.visualize_tree(tree['root'])
+sys.stdout.write("\n".join(full_tree_vis) + "\n")
 
 # Create Evidence Records for each hash
 records = []
 for hash_value in initial_hashes:
-    reduced_tree = EvidenceRecord().reduce_tree(tree, hash_value)
+    reduced_tree = er.reduce_tree(tree, hash_value)
 
-    record = EvidenceRecord().create_evidence_record(tree, reduced_tree, "SHA256")
+    record = er.create_evidence_record(tree, reduced_tree, "SHA256")
 
-    PrintEr().display_evidence_record(record)
+    printer.display_evidence_record(record)
+    print(f"Reduced tree verification: {er.verify_reduced_tree(reduced_tree, hash_value, 'SHA256')}")
 
     records.append(record)
 
 # Simulate rehash with a new algorithm
 records_and_hashes = [
-    (records[0], "H1"),
-    (records[1], "H2"),
-    (records[2], "H3")
+    (records[0], hashlib.sha512(documents[0]).digest()),
+    (records[1], hashlib.sha512(documents[1]).digest()),
+    (records[2], hashlib.sha512(documents[2]).digest())
 ]
 
 # Perform renewal
-renewed_records, new_tree = EvidenceRecord().renew_hashtree(records_and_hashes, "SHA512")
+renewed_records, new_tree = er.renew_hashtree(records_and_hashes, "SHA512")
 
 # Visualize the full and reduced trees
 print("\n============================================")
 print("\nFull hash tree:")
-full_tree_vis = PrintEr().visualize_tree(new_tree['root'])
-for line in full_tree_vis:
-    print(line)
+full_tree_vis = printer.visualize_tree(new_tree['root'])
+sys.stdout.write("\n".join(full_tree_vis) + "\n")
 
 for i, record in enumerate(renewed_records):
-    PrintEr().display_evidence_record(record)
+    printer.display_evidence_record(record)
 
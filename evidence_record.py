@@ -22,114 +22,350 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import hashlib
 import os
 import time
-from typing import List, Tuple
+from bisect import bisect_right
+from typing import List, NamedTuple, Tuple
 
 __NAME__ = "Evidence Record Library"
 __version__ = "1.0.0"  # Following semantic versioning: MAJOR.MINOR.PATCH
 __author__ = "Florian Fischer"
 
+# Supported hash algorithms, backed by hashlib (OpenSSL)
+_HASH_ALGORITHMS = {
+    "SHA256": hashlib.sha256,
+    "SHA512": hashlib.sha512,
+}
+_DIGEST_SIZES = {name: H().digest_size for name, H in _HASH_ALGORITHMS.items()}
+
+class Timestamp(NamedTuple):
+    """Abstract timestamp of a hash value"""
+    hash: bytes
+    time: float
+    algorithm: str
+
+class ArchiveTimeStampChain(NamedTuple):
+    """Entry of an ArchiveTimeStampSequence: reduced hash tree and its timestamp"""
+    reduced: dict
+    timestamp: Timestamp
+
+def _pair_hasher(hash_algorithm: str):
+    """Returns a function that hashes one or two values, bound to the hash algorithm"""
+    H = _HASH_ALGORITHMS[hash_algorithm]
+
+    def pair(left: bytes, right: bytes = None) -> bytes:
+        h = H(left)
+        if right is not None:
+            h.update(right)
+        return h.digest()
+
+    return pair
+
+_PAIR_HASHERS = {name: _pair_hasher(name) for name in _HASH_ALGORITHMS}
+
+def _hash_level_into(source: memoryview, target: memoryview, digest_size: int, H, start: int, end: int, out: int):
+    """Hashes the pairs of source[start:end] into target from byte offset out on
+
+    A trailing single digest is hashed alone, like hash_pair(left).
+    """
+    pair_size = 2 * digest_size
+    single = end - (end - start) % pair_size
+    for i in range(start, single, pair_size):
+        target[out:out + digest_size] = H(source[i:i + pair_size]).digest()
+        out += digest_size
+    if single < end:
+        target[out:out + digest_size] = H(source[single:end]).digest()
+
+def _build_levels(leaf_hashes: bytes, digest_size: int, hash_levels):
+    """Builds the levels of a hash tree from the concatenated leaf hashes
+
+    Nodes are stored level by level in one buffer with the concatenated hashes.
+    level_start holds the index of the first node per level (plus the total).
+    Node level_start[l] + k has the children level_start[l - 1] + 2k (and + 1)
+    and the parent level_start[l + 1] + k // 2, so no links are stored.
+    hash_levels(hashes, level_start) fills the hashes of all levels above the
+    leaves in place.
+    """
+    level_sizes = [len(leaf_hashes) // digest_size]
+    while level_sizes[-1] > 1:
+        level_sizes.append((level_sizes[-1] + 1) // 2)
+    level_start = [0]
+    for size in level_sizes:
+        level_start.append(level_start[-1] + size)
+
+    hashes = bytearray(level_start[-1] * digest_size)
+    hashes[:len(leaf_hashes)] = leaf_hashes
+    hash_levels(hashes, level_start)
+
+    return hashes, level_start
+
+def _children(level_start, level, index):
+    """Returns the indices of the left and right child (-1 if absent) of a node on a level"""
+    if level == 0:
+        return -1, -1
+    left = level_start[level - 1] + 2 * (index - level_start[level])
+    return left, left + 1 if left + 1 < level_start[level] else -1
+
+class Node:
+    """Dict-like view on a node of a hash tree created by create_hashtree"""
+    __slots__ = ('hashes', 'digest_size', 'level_start', 'labels', 'index')
+
+    def __init__(self, tree, index):
+        # The view only refers to the node storage, not to the tree dict itself
+        self.hashes = tree['hashes']
+        self.digest_size = tree['digest_size']
+        self.level_start = tree['level_start']
+        self.labels = tree['labels']
+        self.index = index
+
+    def _node(self, index):
+        node = Node.__new__(Node)
+        node.hashes = self.hashes
+        node.digest_size = self.digest_size
+        node.level_start = self.level_start
+        node.labels = self.labels
+        node.index = index
+        return node
+
+    def __getitem__(self, key):
+        i = self.index
+        level_start = self.level_start
+        level = bisect_right(level_start, i) - 1
+        if key == 'hash':
+            return bytes(self.hashes[i * self.digest_size:(i + 1) * self.digest_size])
+        elif key in ('left', 'right'):
+            j = _children(level_start, level, i)[key == 'right']
+            return self._node(j) if j >= 0 else None
+        elif key == 'parent':
+            if level + 2 >= len(level_start):
+                return None
+            return self._node(level_start[level + 1] + (i - level_start[level]) // 2)
+        elif key == 'level':
+            return level + 1
+        elif key == 'is_leaf':
+            return level == 0
+        elif key == 'leaf_position':
+            if level > 0:
+                return None
+            return 'left' if i % 2 == 0 else 'right'
+        elif key == 'label':
+            return self.labels[i] if self.labels else None
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
 class EvidenceRecord:
-    def __init__(self):
-        self.with_bracket = True
+    __slots__ = ('with_bracket',)
+
+    def __init__(self, with_bracket=False):
+        # Debug only: attach readable labels to the tree nodes for visualization
+        self.with_bracket = with_bracket
 
     @staticmethod
     def version():
         """Return the current version of ervis"""
         return __NAME__ + " " + __version__ + " (c)'2024, " + __author__
 
-    def hash_pair(self, left, right=None, write_brackets=False):
+    @staticmethod
+    def hash_pair(left: bytes, right: bytes = None, hash_algorithm: str = "SHA256") -> bytes:
         """Helper function to hash two values"""
-        left_hash = left
-        right_hash = right
-
-        # In a real implementation, this would use a cryptographic hash
-        # For this example, we simply concatenate the values
-        if right_hash and write_brackets and self.with_bracket:
-            return f"({left_hash}) + ({right_hash})"
-        elif right_hash:
-            return f"{left_hash}+{right_hash}"
+        return _PAIR_HASHERS[hash_algorithm](left, right)
+
+    @staticmethod
+    def hash_levels(hashes: bytearray, level_start, digest_size: int, hash_algorithm: str = "SHA256"):
+        """Fills all levels above the leaves of a hash tree buffer, one level at a time
+
+        Every digest is written straight into its slot of the next level, so
+        no pair and no level is copied into a buffer of its own. This is the
+        hook for other backends: create_hashtree passes it to _build_levels
+        as hash_levels(hashes, level_start) with the digest size and hash
+        algorithm bound, or a function with the same contract instead, like
+        evidence_record_gpu.hash_levels_sha256.
+        """
+        H = _HASH_ALGORITHMS[hash_algorithm]
+        with memoryview(hashes) as view:
+            for current_level in range(len(level_start) - 2):
+                start, end = level_start[current_level:current_level + 2]
+                _hash_level_into(view, view, digest_size, H, start * digest_size, end * digest_size, end * digest_size)
+
+    @staticmethod
+    def format_pair(left: str, right: str = None, write_brackets=False) -> str:
+        """Helper function to build the debug label of two hashed values"""
+        if right is not None and write_brackets:
+            return f"({left}) + ({right})"
+        elif right is not None:
+            return f"{left}+{right}"
+        else:
+            return left
+
+    def create_hashtree(self, hash_values: List[bytes], hash_algorithm: str = "SHA256", labels: List[str] = None, backend: str = "cpu"):
+        """Creates a Merkle hash tree from a list of hash values
+
+        backend selects where the tree is hashed: "cpu" (hashlib) or "gpu"
+        (CuPy, SHA256 only). The GPU is only used when it is asked for.
+        """
+        digest_size = _DIGEST_SIZES[hash_algorithm]
+        if not hash_values:
+            raise ValueError("a hash tree needs at least one hash value")
+        if any(len(h) != digest_size for h in hash_values):
+            raise ValueError(f"hash values must be {hash_algorithm} digests of {digest_size} bytes")
+
+        if backend == "gpu":
+            # The optional backend is only imported when it is asked for
+            import evidence_record_gpu
+            if hash_algorithm != "SHA256":
+                raise ValueError(f"the gpu backend does not support {hash_algorithm}")
+            if not evidence_record_gpu.available():
+                raise RuntimeError("the gpu backend needs cupy and a CUDA device")
+            hash_levels = evidence_record_gpu.hash_levels_sha256
+        elif backend == "cpu":
+            hash_levels = lambda hashes, level_start: self.hash_levels(hashes, level_start, digest_size, hash_algorithm)
         else:
-            return left_hash
+            raise ValueError(f"unknown backend {backend}")
+
+        hashes, level_start = _build_levels(b"".join(hash_values), digest_size, hash_levels)
+        total = level_start[-1]
 
-    def create_hashtree(self, hash_values: List[str]):
-        """Creates a Merkle hash tree from a list of hash values"""
         tree = {
-            'nodes': [],
-            'levels': [],
+            'digest_size': digest_size,
+            'hashes': hashes,
+            'level_start': level_start,
+            'labels': None,
+            'by_hash': {},
             'root': None
         }
 
-        # First level with the input hash values
-        tree['levels'].append([{'hash': h, 'left': None, 'right': None, 'parent': None, 'level': 1, 'is_leaf': True, 'leaf_position': 'left' if i % 2 == 0 else 'right'} for i, h in enumerate(hash_values)])
-        tree['nodes'].extend(tree['levels'][0])
-
-        # Build the tree
-        current_level = 0
-        while len(tree['levels'][current_level]) > 1:
-            next_level = current_level + 1
-            tree['levels'].append([])
-
-            for i in range(0, len(tree['levels'][current_level]), 2):
-                left = tree['levels'][current_level][i]
-                right = tree['levels'][current_level][i + 1] if i + 1 < len(tree['levels'][current_level]) else None
-
-                parent_hash = self.hash_pair(left['hash'], right['hash'] if right else None)
-                parent = {'hash': parent_hash, 'left': left, 'right': right, 'parent': None, 'level': next_level, 'is_leaf': False}
+        if self.with_bracket:
+            # Parents follow their children, so the labels are built bottom up
+            labels = (labels or [h.hex()[:8] for h in hash_values]) + [None] * (total - len(hash_values))
+            tree['labels'] = labels
+            for level in range(1, len(level_start) - 1):
+                for p in range(level_start[level], level_start[level + 1]):
+                    left, right = _children(level_start, level, p)
+                    labels[p] = self.format_pair(labels[left], labels[right] if right >= 0 else None)
 
-                left['parent'] = parent
-                if right:
-                    right['parent'] = parent
+        by_hash = tree['by_hash']
+        for i in range(total):
+            by_hash.setdefault(bytes(hashes[i * digest_size:(i + 1) * digest_size]), i)
 
-                tree['nodes'].append(parent)
-                tree['levels'][next_level].append(parent)
-
-            current_level = next_level
-
-        tree['root'] = tree['levels'][-1][0]
+        tree['root'] = Node(tree, total - 1)
         return tree
 
     @staticmethod
-    def create_timestamp(hash_value: str, timestamp_hash_algorithm: str):
+    def create_timestamp(hash_value: bytes, timestamp_hash_algorithm: str):
         """Creates an abstract timestamp for a hash value"""
-        return {'hash': hash_value, 'time': time.time(), 'algorithm': timestamp_hash_algorithm}
+        return Timestamp(hash_value, time.time(), timestamp_hash_algorithm)
 
     def reduce_tree(self, tree, target_hash):
         """Reduces a hash tree to an Archival Data Object (ADO)"""
-        path = []
-        current = None
+        level_start = tree['level_start']
 
         # Find the node with the target hash
-        for node in tree['nodes']:
-            if node['hash'] == target_hash:
-                current = node
-                break
+        index = tree['by_hash'].get(target_hash)
 
-        if not current:
+        if index is None:
             return None
 
         # Reduced tree as a new structure
-        reduced_tree = {'hash': current['hash'], 'left': None, 'right': None, 'is_leaf': current['is_leaf'], 'leaf_position': current['leaf_position']}
+        reduced_tree = self._reduced_node(tree, index)
         current_reduced = reduced_tree
-        current = current['parent']
+        level = bisect_right(level_start, index) - 1
+
+        # Build the path to the root, the parent and sibling follow from the position on the level
+        while level + 2 < len(level_start):
+            start, end = level_start[level:level + 2]
+            position = index - start
+            index = end + position // 2
+            sibling = start + (position ^ 1)
 
-        # Build the path to the root
-        while current:
-            new_node = {'hash': current['hash'], 'left': None, 'right': None, 'is_leaf': False}
-            if current['left'] and current['left']['hash'] == current_reduced['hash']:
+            new_node = self._reduced_node(tree, index)
+            if position % 2 == 0:
                 new_node['left'] = current_reduced
-                if current['right']:
-                    new_node['right'] = {'hash': current['right']['hash'], 'is_leaf': current['right']['is_leaf'], 'leaf_position': current['right']}
+                if sibling < end:
+                    new_node['right'] = self._reduced_node(tree, sibling)
             else:
                 new_node['right'] = current_reduced
-                new_node['left'] = {'hash': current['left']['hash'], 'is_leaf': current['left']['is_leaf'], 'leaf_position': current['left']}
+                new_node['left'] = self._reduced_node(tree, sibling)
 
             current_reduced = new_node
-            current = current['parent']
+            level += 1
 
         return current_reduced
 
+    @staticmethod
+    def _reduced_node(tree, index):
+        """Helper function to copy a tree node into a reduced tree"""
+        digest_size = tree['digest_size']
+        is_leaf = index < tree['level_start'][1]
+        node = {
+            'hash': bytes(tree['hashes'][index * digest_size:(index + 1) * digest_size]),
+            'left': None,
+            'right': None,
+            'is_leaf': is_leaf,
+            'leaf_position': ('left' if index % 2 == 0 else 'right') if is_leaf else None
+        }
+        # Debug labels are only kept in with_bracket mode
+        if tree['labels']:
+            node['label'] = tree['labels'][index]
+        return node
+
+    def verify_reduced_tree(self, reduced_tree, target_hash: bytes, hash_algorithm: str = "SHA256") -> bool:
+        """Verifies that a reduced tree contains the target hash and that all its hashes are consistent"""
+        if not reduced_tree:
+            return False
+
+        # Hashes of the wrong size cannot match, reject them before any hashing
+        digest_size = _DIGEST_SIZES.get(hash_algorithm)
+        if len(reduced_tree['hash']) != digest_size or len(target_hash) != digest_size:
+            return False
+
+        # Flatten the reduced tree into index arrays (children after their parent)
+        # and look for the target hash in the leaf nodes on the way
+        nodes = [reduced_tree]
+        left_index = [-1]
+        right_index = [-1]
+        found = False
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            if node['is_leaf'] and node['hash'] == target_hash:
+                found = True
+            for child, child_index in ((node.get('left'), left_index), (node.get('right'), right_index)):
+                if child:
+                    child_index[i] = len(nodes)
+                    nodes.append(child)
+                    left_index.append(-1)
+                    right_index.append(-1)
+            i += 1
+
+        if not found:
+            return False
+
+        # Verify the hash calculations from bottom to top
+        pair = _PAIR_HASHERS[hash_algorithm]
+        hashes = [node['hash'] for node in nodes]
+        for i in range(len(nodes) - 1, -1, -1):
+            left = left_index[i]
+            right = right_index[i]
+
+            # Leaves and sibling nodes without children are taken as given
+            if left < 0 and right < 0:
+                continue
+
+            if left >= 0 and right >= 0:
+                calculated_hash = pair(hashes[left], hashes[right])
+            else:
+                calculated_hash = pair(hashes[max(left, right)])
+            if calculated_hash != hashes[i]:
+                return False
+
+        return True
+
     def create_evidence_record(self, tree, reduced_tree, hash_algorithm):
         """Creates an Evidence Record for a specific hash"""
         timestamp = self.create_timestamp(tree['root']['hash'], hash_algorithm)
@@ -140,61 +376,82 @@ class EvidenceRecord:
             'cryptoInfos': [],
             'encryptionInfo': None,
             'archiveTimeStampSequence': [
-                {
-                    'reduced': reduced_tree,
-                    'timestamp': timestamp
-                }
+                ArchiveTimeStampChain(reduced_tree, timestamp)
             ]
         }
 
-    def encode_atsc(self, sequence):
-        """Helper function to convert an ArchiveTimeStampSequence to a string"""
-        # In a real implementation, this would use DER encoding
-        # For this example, we simply concatenate the hashes
-        encoded = ''
+    @staticmethod
+    def to_dict(value):
+        """Converts an Evidence Record (or a part of it) to plain dicts and lists, e.g. for JSON"""
+        if isinstance(value, tuple) and hasattr(value, '_asdict'):
+            value = value._asdict()
+        if isinstance(value, dict):
+            return {key: EvidenceRecord.to_dict(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [EvidenceRecord.to_dict(item) for item in value]
+        if isinstance(value, (bytes, bytearray)):
+            return value.hex()
+        return value
+
+    @staticmethod
+    def _atsc_digest(sequence, hash_algorithm: str = "SHA256") -> bytes:
+        """Helper function to hash an ArchiveTimeStampSequence in a single pass"""
+        # In a real implementation, the DER encoding of the sequence would be hashed
+        # For this example, we stream the hashes of all timestamps into the digest
+        h = _HASH_ALGORITHMS[hash_algorithm]()
         for ats in sequence:
-            # last current ats-hash is taken
-            encoded = ats['timestamp']['hash']
-        return encoded
+            h.update(ats.timestamp.hash)
+        return h.digest()
 
-    def renew_hashtree(self, records_and_hashes, new_hash_algorithm):
-        """Renews the hash tree for a list of Evidence Records with new hash values"""
+    def renew_hashtree(self, records_and_hashes, new_hash_algorithm, executor=None):
+        """Renews the hash tree for a list of Evidence Records with new hash values
+
+        The reduced trees are independent of each other; an optional
+        thread based executor (e.g. concurrent.futures.ThreadPoolExecutor)
+        is used to create them in parallel. They are read from the shared new
+        tree, so process pools are not supported.
+        """
         new_hashes = []
+        record_hashes = []
+        labels = [] if self.with_bracket else None
+        pair = _PAIR_HASHERS[new_hash_algorithm]
 
         # Step 3 & 4: For each Evidence Record
         for record, new_document_hash in records_and_hashes:
-            # Encode the existing ArchiveTimeStampSequence
-            atsc = self.encode_atsc(record['archiveTimeStampSequence'])
-            atsc_hash = self.hash_pair(atsc)  # Step 3: ha(i) = H(atsc(i))
+            # Step 3: ha(i) = H(atsc(i)) of the existing ArchiveTimeStampSequence
+            atsc_hash = self._atsc_digest(record['archiveTimeStampSequence'], new_hash_algorithm)
 
             # Step 4: Combine Document Hash with ATSC Hash
             if isinstance(new_document_hash, list):
-                for hash_value in new_document_hash:
-                    # Step 4: Combine Document Hash with ATSC Hash
-                    combined_hash = self.hash_pair(hash_value, atsc_hash, True)
-                    new_hashes.append(combined_hash)
+                document_hashes = new_document_hash
+                if not document_hashes:
+                    raise ValueError("each Evidence Record needs at least one hash value")
             else:
+                document_hashes = [new_document_hash]
+
+            for hash_value in document_hashes:
                 # Step 4: Combine Document Hash with ATSC Hash
-                combined_hash = self.hash_pair(new_document_hash, atsc_hash, True)
+                combined_hash = pair(hash_value, atsc_hash)
                 new_hashes.append(combined_hash)
+                if labels is not None:
+                    labels.append(self.format_pair(hash_value.hex()[:8], atsc_hash.hex()[:8], True))
 
-        # Step 5: Create a new hash tree with the combined hashes
-        new_tree = self.create_hashtree(new_hashes)
+            # The first combined hash of the record is used for its reduced tree
+            record_hashes.append(new_hashes[len(new_hashes) - len(document_hashes)])
 
-        # Create reduced trees for each Evidence Record
-        results = []
-        for record, new_document_hash in records_and_hashes:
-            combined_hash = new_hashes[records_and_hashes.index((record, new_document_hash))]
+        # Step 5: Create a new hash tree with the combined hashes
+        new_tree = self.create_hashtree(new_hashes, new_hash_algorithm, labels)
 
-            # Reduce the tree for the specific hash
-            reduced_tree = self.reduce_tree(new_tree, combined_hash)
+        # Create reduced trees for each Evidence Record (read-only on the new tree)
+        mapper = executor.map if executor else map
+        reduced_trees = list(mapper(lambda combined_hash: self.reduce_tree(new_tree, combined_hash), record_hashes))
 
+        # Update the Evidence Records one after another
+        results = []
+        for (record, _), reduced_tree in zip(records_and_hashes, reduced_trees):
             # Step 6: Create new ArchiveTimeStampChain
             new_timestamp = self.create_timestamp(new_tree['root']['hash'], new_hash_algorithm)
-            new_chain = {
-                'reduced': reduced_tree,
-                'timestamp': new_timestamp
-            }
+            new_chain = ArchiveTimeStampChain(reduced_tree, new_timestamp)
 
             # Add the new chain to the sequence
             record['archiveTimeStampSequence'].append(new_chain)
@@ -0,0 +1,176 @@
+"""
+MIT License
+
+Copyright (c) 2024 Florian Fischer
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# Optional GPU backend (CuPy) to hash the levels of large SHA-256 hash trees.
+# It is only used with create_hashtree(..., backend="gpu"). cupy is only
+# imported on first use, the library itself does not depend on it.
+#
+# Run this module to check that the GPU and CPU backends build identical trees:
+#     python evidence_record_gpu.py
+
+import functools
+
+# Size of a SHA-256 digest, the only algorithm of this backend
+# (create_hashtree rejects backend="gpu" for any other algorithm)
+DIGEST_SIZE = 32
+
+# One thread per parent node: SHA-256 of two concatenated 32-byte children,
+# or of a single trailing child, written to the next level of the tree buffer
+_MERKLE_LEVEL_SOURCE = r"""
+__device__ __constant__ unsigned int K[64] = {
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+};
+
+#define ROTR(x, n) (((x) >> (n)) | ((x) << (32 - (n))))
+
+__device__ void sha256_compress(unsigned int *state, const unsigned int *block)
+{
+    unsigned int w[64];
+    for (int i = 0; i < 16; i++)
+        w[i] = block[i];
+    for (int i = 16; i < 64; i++) {
+        unsigned int s0 = ROTR(w[i - 15], 7) ^ ROTR(w[i - 15], 18) ^ (w[i - 15] >> 3);
+        unsigned int s1 = ROTR(w[i - 2], 17) ^ ROTR(w[i - 2], 19) ^ (w[i - 2] >> 10);
+        w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+    }
+
+    unsigned int a = state[0], b = state[1], c = state[2], d = state[3];
+    unsigned int e = state[4], f = state[5], g = state[6], h = state[7];
+    for (int i = 0; i < 64; i++) {
+        unsigned int t1 = h + (ROTR(e, 6) ^ ROTR(e, 11) ^ ROTR(e, 25)) + ((e & f) ^ (~e & g)) + K[i] + w[i];
+        unsigned int t2 = (ROTR(a, 2) ^ ROTR(a, 13) ^ ROTR(a, 22)) + ((a & b) ^ (a & c) ^ (b & c));
+        h = g; g = f; f = e; e = d + t1;
+        d = c; c = b; b = a; a = t1 + t2;
+    }
+    state[0] += a; state[1] += b; state[2] += c; state[3] += d;
+    state[4] += e; state[5] += f; state[6] += g; state[7] += h;
+}
+
+extern "C" __global__ void merkle_level(const unsigned char *level, unsigned char *next_level, int count)
+{
+    int k = blockDim.x * blockIdx.x + threadIdx.x;
+    if (k >= (count + 1) / 2)
+        return;
+
+    const unsigned char *in = level + 64 * k;
+    int words = (2 * k + 1 < count) ? 16 : 8;
+    unsigned int state[8] = {
+        0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+        0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+    };
+    unsigned int block[16];
+    for (int i = 0; i < words; i++)
+        block[i] = ((unsigned int)in[4 * i] << 24) | ((unsigned int)in[4 * i + 1] << 16) | ((unsigned int)in[4 * i + 2] << 8) | in[4 * i + 3];
+
+    if (words == 16) {
+        // Two children fill the first block, the padding is a block of its own
+        sha256_compress(state, block);
+        block[0] = 0x80000000;
+        for (int i = 1; i < 15; i++)
+            block[i] = 0;
+        block[15] = 512;
+    } else {
+        // A single child is padded within the first block
+        block[8] = 0x80000000;
+        for (int i = 9; i < 15; i++)
+            block[i] = 0;
+        block[15] = 256;
+    }
+    sha256_compress(state, block);
+
+    unsigned char *out = next_level + 32 * k;
+    for (int i = 0; i < 8; i++) {
+        out[4 * i] = state[i] >> 24;
+        out[4 * i + 1] = state[i] >> 16;
+        out[4 * i + 2] = state[i] >> 8;
+        out[4 * i + 3] = state[i];
+    }
+}
+"""
+
+@functools.lru_cache(maxsize=1)
+def available():
+    """Returns True if cupy is installed and a CUDA device is present"""
+    try:
+        import cupy
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except Exception:
+        return False
+
+@functools.lru_cache(maxsize=1)
+def _merkle_level_kernel():
+    """Compiles the level kernel on first use"""
+    import cupy
+    return cupy.RawKernel(_MERKLE_LEVEL_SOURCE, 'merkle_level')
+
+def hash_levels_sha256(hashes: bytearray, level_start, threads_per_block=256):
+    """Fills all levels above the leaves of a SHA-256 hash tree buffer on the GPU
+
+    The leaves are copied to the device once, every level is hashed by one
+    kernel launch straight into the next level, and the computed levels are
+    copied back once at the end. The kernel only computes SHA-256, so the
+    buffer must hold digests of DIGEST_SIZE bytes.
+    """
+    import cupy
+    import numpy
+
+    if len(hashes) != level_start[-1] * DIGEST_SIZE:
+        raise ValueError(f"the gpu backend only hashes SHA256 digests of {DIGEST_SIZE} bytes")
+
+    kernel = _merkle_level_kernel()
+    tree = cupy.asarray(numpy.frombuffer(hashes, dtype=numpy.uint8))
+    for current_level in range(len(level_start) - 2):
+        start, end, next_end = level_start[current_level:current_level + 3]
+        blocks = (next_end - end + threads_per_block - 1) // threads_per_block
+        kernel((blocks,), (threads_per_block,), (tree[start * DIGEST_SIZE:], tree[end * DIGEST_SIZE:], numpy.int32(end - start)))
+
+    hashes[level_start[1] * DIGEST_SIZE:] = cupy.asnumpy(tree[level_start[1] * DIGEST_SIZE:]).tobytes()
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    from evidence_record import EvidenceRecord
+
+    if not available():
+        print("cupy or a CUDA device is not available, skipping the GPU backend check")
+        sys.exit(0)
+
+    er = EvidenceRecord()
+    # Sizes with a trailing single node on some levels, plus one larger tree
+    for count in (1, 2, 3, 5, 8, 255, 256, 257, 1000, 65537):
+        hash_values = [os.urandom(DIGEST_SIZE) for _ in range(count)]
+        cpu_tree = er.create_hashtree(hash_values, "SHA256", backend="cpu")
+        gpu_tree = er.create_hashtree(hash_values, "SHA256", backend="gpu")
+        if cpu_tree['hashes'] != gpu_tree['hashes']:
+            print(f"GPU and CPU hash trees differ for {count} leaves")
+            sys.exit(1)
+    print("GPU and CPU backends build identical hash trees")
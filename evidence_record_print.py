@@ -23,18 +23,40 @@ SOFTWARE.
 """
 
 from datetime import datetime
+import functools
+import sys
 import time
 
+@functools.lru_cache(maxsize=256)
+def _spaces(n):
+    """Helper function to generate (and cache) spaces"""
+    return " " * n
+
+@functools.lru_cache(maxsize=64)
+def _frame(width):
+    """Helper function to generate (and cache) the top/bottom frame of a node"""
+    return f"+{'-' * (width + 2)}+"
+
+@functools.lru_cache(maxsize=1024)
+def _format_timestamp(t):
+    """Helper function to format (and cache) a timestamp in whole seconds"""
+    return datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+
 class PrintEr:
-    def spaces(self, n):
+    __slots__ = ()
+
+    @staticmethod
+    def spaces(n):
         """Helper function to generate spaces"""
-        return " " * n
+        return _spaces(n)
 
-    def visualize_node(self, hash_value):
+    @staticmethod
+    def visualize_node(hash_value, label=None):
         """Visualizes a single node"""
-        width = len(hash_value)
-        top = f"+{'-' * (width + 2)}+"
-        middle = f"| {hash_value} |"
+        # Only the beginning of the (binary) hash is shown, unless a debug label is given
+        text = label or hash_value.hex()[:8]
+        top = _frame(len(text))
+        middle = f"| {text} |"
         return [top, middle, top]
 
     def connect_nodes(self, left_lines, right_lines, center_spacing):
@@ -46,11 +68,11 @@ class PrintEr:
         right_width = len(right_lines[0]) if right_lines else 0
 
         if left_lines and right_lines:
-            first_line = f"{self.spaces(left_width // 2)}/{self.spaces(center_spacing - 2)}\\{self.spaces(right_width // 2)}"
+            first_line = "".join((_spaces(left_width // 2), "/", _spaces(center_spacing - 2), "\\", _spaces(right_width // 2)))
         elif left_lines:
-            first_line = f"{self.spaces(left_width // 2)}|"
+            first_line = "".join((_spaces(left_width // 2), "|"))
         elif right_lines:
-            first_line = f"{self.spaces(center_spacing)}{self.spaces(right_width // 2)}|"
+            first_line = "".join((_spaces(center_spacing), _spaces(right_width // 2), "|"))
 
         result.append(first_line)
         return result
@@ -60,41 +82,54 @@ class PrintEr:
         if not node:
             return []
 
-        lines = []
-        node_lines = self.visualize_node(node['hash'])
-
-        # Recursively visualize child nodes
-        left_lines = self.visualize_tree(node.get('left'), prefix + "  ")
-        right_lines = self.visualize_tree(node.get('right'), prefix + "  ")
-
-        # Calculate widths
-        left_width = len(left_lines[0]) if left_lines else 0
-        right_width = len(right_lines[0]) if right_lines else 0
-        node_width = len(node_lines[0])
         spacing = 4
-
-        # Center the node
-        node_padding = max(0, (left_width + right_width + spacing - node_width) // 2)
-        for line in node_lines:
-            lines.append(self.spaces(node_padding) + line)
-
-        # Add connection lines
-        if node.get('left') or node.get('right'):
-            connections = self.connect_nodes(
-                left_lines[0] if left_lines else None,
-                right_lines[0] if right_lines else None,
-                spacing
-            )
-            lines.extend(connections)
-
-        # Add child nodes
-        max_child_lines = max(len(left_lines), len(right_lines))
-        for i in range(max_child_lines):
-            left_line = left_lines[i] if left_lines and i < len(left_lines) else self.spaces(left_width)
-            right_line = right_lines[i] if right_lines and i < len(right_lines) else self.spaces(right_width)
-            lines.append(left_line + self.spaces(spacing) + right_line)
-
-        return lines
+        rendered = {}
+
+        # Iterative post-order traversal, the children are rendered before their parent
+        stack = [(node, node.get('left'), node.get('right'), False)]
+        while stack:
+            current, left, right, children_done = stack.pop()
+            if not children_done:
+                stack.append((current, left, right, True))
+                for child in (right, left):
+                    if child:
+                        stack.append((child, child.get('left'), child.get('right'), False))
+                continue
+
+            node_lines = self.visualize_node(current['hash'], current.get('label'))
+            left_lines = rendered.pop(id(left), []) if left else []
+            right_lines = rendered.pop(id(right), []) if right else []
+
+            # Calculate widths
+            left_width = len(left_lines[0]) if left_lines else 0
+            right_width = len(right_lines[0]) if right_lines else 0
+            node_width = len(node_lines[0])
+
+            # Center the node
+            padding = _spaces(max(0, (left_width + right_width + spacing - node_width) // 2))
+            lines = ["".join((padding, line)) for line in node_lines]
+
+            # Add connection lines
+            if left or right:
+                connections = self.connect_nodes(
+                    left_lines[0] if left_lines else None,
+                    right_lines[0] if right_lines else None,
+                    spacing
+                )
+                lines.extend(connections)
+
+            # Add child nodes
+            left_blank = _spaces(left_width)
+            right_blank = _spaces(right_width)
+            gap = _spaces(spacing)
+            for i in range(max(len(left_lines), len(right_lines))):
+                left_line = left_lines[i] if i < len(left_lines) else left_blank
+                right_line = right_lines[i] if i < len(right_lines) else right_blank
+                lines.append("".join((left_line, gap, right_line)))
+
+            rendered[id(current)] = lines
+
+        return rendered[id(node)]
 
     def create_header_box(self, text, width):
         """Helper function to create a header box"""
@@ -107,15 +142,17 @@ class PrintEr:
 
     def merge_lines_horizontally(self, left, right, spacing=4):
         """Helper function to merge lines side by side"""
-        result = []
         max_lines = max(len(left), len(right))
-        left_width = len(left[0]) if left else 0
-        
+        result = [""] * max_lines
+        left_blank = _spaces(len(left[0]) if left else 0)
+        right_blank = _spaces(len(right[0]) if right else 0)
+        gap = _spaces(spacing)
+
         for i in range(max_lines):
-            left_line = left[i] if i < len(left) else self.spaces(left_width)
-            right_line = right[i] if i < len(right) else self.spaces(len(right[0]) if right else 0)
-            result.append(left_line + self.spaces(spacing) + right_line)
-            
+            left_line = left[i] if i < len(left) else left_blank
+            right_line = right[i] if i < len(right) else right_blank
+            result[i] = "".join((left_line, gap, right_line))
+
         return result
 
     def print_evidence_record(self, evidence_record):
@@ -146,21 +183,19 @@ class PrintEr:
                 lines.append("")
                 
                 # Print timestamp information
-                if timestamp := ats.get('timestamp'):
-                    timestamp_str = datetime.fromtimestamp(timestamp.get('time')).strftime("%Y-%m-%d %H:%M:%S")
+                if timestamp := getattr(ats, 'timestamp', None):
+                    timestamp_str = _format_timestamp(int(timestamp.time))
                     timestamp_box = self.create_header_box(
-                        f"Timestamp: {timestamp_str} [{timestamp.get('algorithm', 'Unknown')}]",
+                        f"Timestamp: {timestamp_str} [{timestamp.algorithm or 'Unknown'}]",
                         50
                     )
                     
-                    for line in timestamp_box:
-                        lines.append("  " + line)  # indent timestamp
+                    lines.extend(["  " + line for line in timestamp_box])  # indent timestamp
                 
                 # Visualize reduced tree if present
-                if reduced := ats.get('reduced'):
+                if reduced := getattr(ats, 'reduced', None):
                     tree_lines = self.visualize_tree(reduced)
-                    for line in tree_lines:
-                        lines.append("  " + line)  # indent tree
+                    lines.extend(["  " + line for line in tree_lines])  # indent tree
                 
                 lines.append("")
                 if i < len(ats_sequence):
@@ -170,5 +205,5 @@ class PrintEr:
 
     def display_evidence_record(self, evidence_record):
         """Helper function to print the lines to console"""
-        for line in self.print_evidence_record(evidence_record):
-            print(line)
+        lines = self.print_evidence_record(evidence_record)
+        sys.stdout.write("\n".join(lines) + "\n")